@@ -2,6 +2,7 @@
 SQLite database for tracking
 """
 
+import asyncio
 import sqlite3
 import json
 import logging
@@ -90,6 +91,9 @@ class Database:
         Check if product is new or restocked
         Returns: (is_new, is_restocked)
         """
+        return await asyncio.to_thread(self._check_product, product)
+    
+    def _check_product(self, product: Dict) -> Tuple[bool, bool]:
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -116,11 +120,47 @@ class Database:
     
     async def save_product(self, product: Dict, is_new: bool, is_restock: bool):
         """Save or update product"""
+        return await asyncio.to_thread(self._save_product, product, is_new, is_restock)
+    
+    def _save_product(self, product: Dict, is_new: bool, is_restock: bool):
         conn = self._get_connection()
         cursor = conn.cursor()
         
+        self._write_product(cursor, product, is_new, is_restock, datetime.now().isoformat())
+        
+        conn.commit()
+        conn.close()
+    
+    async def save_products(self, items: List[Tuple[Dict, bool, bool]]):
+        """Save or update a batch of (product, is_new, is_restock) in one transaction"""
+        return await asyncio.to_thread(self._save_products, items)
+    
+    def _save_products(self, items: List[Tuple[Dict, bool, bool]]):
+        conn = self._get_connection()
+        cursor = conn.cursor()
         now = datetime.now().isoformat()
+        
+        for product, is_new, is_restock in items:
+            try:
+                self._write_product(cursor, product, is_new, is_restock, now)
+            except Exception as e:
+                logger.error("Error saving product %s: %s", product.get('id'), e)
+        
+        conn.commit()
+        conn.close()
+    
+    def _write_product(self, cursor, product: Dict, is_new: bool, is_restock: bool, now: str):
+        """Write one product on an open cursor, the caller commits"""
         sizes_json = json.dumps(product.get('sizes', {}))
+        price = float(product.get('price', 0)) if str(product.get('price', '0')).replace('.', '', 1).isdigit() else 0
+        original_price = float(product.get('original_price', 0)) if str(product.get('original_price', '0')).replace('.', '', 1).isdigit() else 0
+        
+        # Previous price, read once before it is overwritten
+        old_price = None
+        if not is_new:
+            cursor.execute('SELECT price FROM products WHERE id = ?', (product['id'],))
+            row = cursor.fetchone()
+            old_price = row[0] if row else None
         
         if is_new:
             # Insert new product
@@ -132,8 +172,8 @@ class Database:
             ''', (
                 product['id'],
                 product['name'],
-                float(product.get('price', 0)) if str(product.get('price', '0')).replace('.', '', 1).isdigit() else 0,
-                float(product.get('original_price', 0)) if str(product.get('original_price', '0')).replace('.', '', 1).isdigit() else 0,
+                price,
+                original_price,
                 product['url'],
                 product.get('image', ''),
                 sizes_json,
@@ -152,8 +192,8 @@ class Database:
                 WHERE id = ?
             ''', (
                 product['name'],
-                float(product.get('price', 0)) if str(product.get('price', '0')).replace('.', '', 1).isdigit() else 0,
-                float(product.get('original_price', 0)) if str(product.get('original_price', '0')).replace('.', '', 1).isdigit() else 0,
+                price,
+                original_price,
                 product['url'],
                 product.get('image', ''),
                 sizes_json,
@@ -184,20 +224,17 @@ class Database:
             ''', (now, product['id']))
         
         # Update price history if changed
-        cursor.execute('SELECT price FROM products WHERE id = ?', (product['id'],))
-        old_price = cursor.fetchone()
-        
-        if old_price and float(old_price[0]) != float(product.get('price', 0)):
+        if old_price is not None and float(old_price) != price:
             cursor.execute('''
                 INSERT INTO price_history (product_id, price)
                 VALUES (?, ?)
-            ''', (product['id'], float(product.get('price', 0))))
-        
-        conn.commit()
-        conn.close()
+            ''', (product['id'], price))
     
     async def record_check(self, products_found: int, alerts_sent: int):
         """Record bot check statistics"""
+        return await asyncio.to_thread(self._record_check, products_found, alerts_sent)
+    
+    def _record_check(self, products_found: int, alerts_sent: int):
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -211,6 +248,9 @@ class Database:
     
     async def get_stats(self) -> Dict:
         """Get bot statistics"""
+        return await asyncio.to_thread(self._get_stats)
+    
+    def _get_stats(self) -> Dict:
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -253,6 +293,9 @@ class Database:
     
     async def cleanup_old_products(self, active_product_ids: List[str]):
         """Mark inactive products"""
+        return await asyncio.to_thread(self._cleanup_old_products, active_product_ids)
+    
+    def _cleanup_old_products(self, active_product_ids: List[str]):
         if not active_product_ids:
             return
         
@@ -271,4 +314,4 @@ class Database:
         conn.commit()
         conn.close()
         
-        logger.info(f"Cleaned up inactive products")
+        logger.info("Cleaned up inactive products")
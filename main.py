@@ -6,7 +6,7 @@ import asyncio
 import logging
 import sys
 import os
-from datetime import datetime, timedelta
+import time
 import signal
 import random
 
@@ -27,19 +27,38 @@ from shein_client import SheinClient
 from telegram_manager import TelegramManager
 from database import Database
 
+SHUTDOWN_TEMPLATE = """
+🛑 <b>SHEIN BOT SHUTTING DOWN</b>
+
+📊 <b>Final Stats:</b>
+• Total Checks: {checks}
+• Products Found: {products_found}
+• Alerts Sent: {alerts_sent}
+• New Today: {new_today}
+• Restocks: {restocks_today}
+
+⏰ <b>Uptime:</b> {hours}:{minutes:02d}:{seconds:02d}
+
+👋 <b>Goodbye!</b>
+"""
+
 class SheinVerseBot:
     def __init__(self):
         self.telegram = TelegramManager()
+        self.client = SheinClient()
         self.db = Database()
         self.running = False
         self.consecutive_failures = 0
         self.max_failures = 5
+        self.summary_interval = 2 * 60 * 60  # 2 hours
+        self._stop = asyncio.Event()
         self.stats = {
             'checks': 0,
             'products_found': 0,
-            'alerts_sent': 0,
-            'start_time': datetime.now()
+            'alerts_sent': 0
         }
+        self.start_monotonic = time.monotonic()
+        self._rng = random.Random()
         
     async def initialize(self):
         """Initialize bot"""
@@ -67,139 +86,198 @@ class SheinVerseBot:
     async def scan_products(self):
         """Scan for new products"""
         try:
-            async with SheinClient() as client:
-                # Get current products
-                products = await client.get_shein_verse_men()
-                
-                if not products:
-                    logger.warning("⚠️ No products found")
-                    self.consecutive_failures += 1
-                    return False
+            # Get current products
+            products = await self.client.get_shein_verse_men()
+            
+            if not products:
+                logger.warning("⚠️ No products found")
+                self.consecutive_failures += 1
+                return False
+            
+            logger.info("✅ Found %d Men's products", len(products))
+            
+            self.stats['checks'] += 1
+            self.stats['products_found'] = len(products)
+            self.consecutive_failures = 0  # Reset on success
+            
+            # Look up every product concurrently
+            checks = await asyncio.gather(
+                *(self.db.check_product(product) for product in products),
+                return_exceptions=True
+            )
+            
+            alerts = []
+            to_save = []
+            # Every listed product stays active, even if its lookup failed
+            active_ids = [product['id'] for product in products]
+            
+            for product, check in zip(products, checks):
+                if isinstance(check, Exception):
+                    logger.error("Error processing product: %s", check)
+                    continue
                 
-                logger.info(f"✅ Found {len(products)} Men's products")
+                is_new, is_restock = check
+                to_save.append((product, is_new, is_restock))
                 
-                self.stats['checks'] += 1
-                self.stats['products_found'] = len(products)
-                self.consecutive_failures = 0  # Reset on success
+                if is_restock:
+                    # Stock is moving, don't serve its sizes from cache next scan
+                    self.client.invalidate_details(product['url'])
                 
-                # Process each product
+                if is_new or is_restock:
+                    alerts.append((product, is_new))
+                    logger.info("🚨 Alert queued: %.50s...", product['name'])
+            
+            # Alerts go out while the batch is written to the database
+            alerts_sent, saved = await asyncio.gather(
+                self._send_alerts(alerts),
+                self.db.save_products(to_save),
+                return_exceptions=True
+            )
+            
+            # One side failing must not lose the other's result
+            if isinstance(saved, Exception):
+                logger.error("Error saving products: %s", saved)
+            if isinstance(alerts_sent, Exception):
+                logger.error("Error sending alerts: %s", alerts_sent)
                 alerts_sent = 0
-                active_ids = []
-                
-                for product in products:
-                    try:
-                        active_ids.append(product['id'])
-                        
-                        # Check if new or restocked
-                        is_new, is_restock = await self.db.check_product(product)
-                        
-                        if is_new or is_restock:
-                            # Send alert
-                            await self.telegram.send_product_alert(product, is_new)
-                            alerts_sent += 1
-                            self.stats['alerts_sent'] += 1
-                            
-                            logger.info(f"🚨 Alert sent: {product['name'][:50]}...")
-                            
-                            # Small delay between alerts
-                            await asyncio.sleep(1)
-                        
-                        # Save to database
-                        await self.db.save_product(product, is_new, is_restock)
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing product: {str(e)}")
-                        continue
-                
-                # Cleanup old products
-                await self.db.cleanup_old_products(active_ids)
-                
-                # Record statistics
-                await self.db.record_check(len(products), alerts_sent)
-                
-                logger.info(f"📊 Scan complete. Alerts sent: {alerts_sent}")
-                return True
-                
+            self.stats['alerts_sent'] += alerts_sent
+            
+            # Cleanup old products
+            await self.db.cleanup_old_products(active_ids)
+            
+            # Record statistics
+            await self.db.record_check(len(products), alerts_sent)
+            
+            logger.debug("📊 Scan complete. Alerts sent: %d", alerts_sent)
+            return True
+            
         except Exception as e:
             self.consecutive_failures += 1
-            logger.error(f"❌ Scan failed: {str(e)}")
+            logger.error("❌ Scan failed: %s", e)
             
             if self.consecutive_failures >= 3:
                 await self.telegram.send_error_alert(str(e))
             
             return False
     
+    async def _send_alerts(self, alerts) -> int:
+        """Send queued alerts, returns number delivered"""
+        if not alerts:
+            return 0
+        return await self.telegram.send_product_alerts(alerts)
+    
     async def run(self):
         """Main bot loop"""
+        if self._stop.is_set():
+            return  # Stopped during initialization
         self.running = True
         
         logger.info("🔄 Starting main loop...")
         
-        last_summary_time = datetime.now()
-        summary_interval = timedelta(hours=2)
+        # Scans and summaries run on independent timers
+        tasks = [
+            asyncio.create_task(self._check_loop()),
+            asyncio.create_task(self._summary_loop())
+        ]
+        
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            logger.info("Bot loop cancelled")
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    def stop(self):
+        """Stop the loops, waking any pending sleep immediately"""
+        self.running = False
+        self._stop.set()
+    
+    async def _sleep(self, seconds: float) -> bool:
+        """Sleep for up to `seconds`, returns True if the bot was stopped"""
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
+    async def _check_loop(self):
+        """Scan on a fixed cadence measured from the start of each scan"""
+        loop = asyncio.get_running_loop()
         
         while self.running:
+            started = loop.time()
+            
             try:
-                current_time = datetime.now()
-                
                 # Check if too many failures
                 if self.consecutive_failures >= self.max_failures:
                     wait_time = 300  # 5 minutes
-                    logger.warning(f"⚠️ Multiple failures. Waiting {wait_time}s...")
-                    await asyncio.sleep(wait_time)
+                    logger.warning("⚠️ Multiple failures. Waiting %ds...", wait_time)
+                    if await self._sleep(wait_time):
+                        break
                     self.consecutive_failures = 0
+                    started = loop.time()
                 
                 # Perform scan
                 await self.scan_products()
                 
-                # Send summary every 2 hours
-                if current_time - last_summary_time >= summary_interval:
-                    stats = await self.db.get_stats()
-                    await self.telegram.send_summary(stats)
-                    last_summary_time = current_time
-                    logger.info("📋 Sent periodic summary")
-                
                 # Calculate next check time with jitter
                 interval_seconds = Config.CHECK_INTERVAL_MINUTES * 60
-                jitter = random.randint(-30, 30)  # ±30 seconds
+                jitter = self._rng.randint(-30, 30)  # ±30 seconds
                 wait_time = max(60, interval_seconds + jitter)
                 
-                logger.info(f"⏳ Next check in {wait_time//60} minutes...")
-                await asyncio.sleep(wait_time)
-                
-            except asyncio.CancelledError:
-                logger.info("Bot loop cancelled")
+            except Exception as e:
+                logger.error("Main loop error: %s", e)
+                wait_time = 60  # Wait before retry
+            
+            # Sleep only what is left of the interval after the scan itself
+            delay = max(0, started + wait_time - loop.time())
+            logger.debug("⏳ Next check in %d seconds...", delay)
+            if await self._sleep(delay):
+                break
+    
+    async def _summary_loop(self):
+        """Send a status summary every summary_interval seconds"""
+        loop = asyncio.get_running_loop()
+        next_wake = loop.time() + self.summary_interval
+        
+        while self.running:
+            if await self._sleep(max(0, next_wake - loop.time())):
                 break
+            next_wake += self.summary_interval
+            
+            try:
+                stats = await self.db.get_stats()
+                await self.telegram.send_summary(stats)
+                logger.info("📋 Sent periodic summary")
             except Exception as e:
-                logger.error(f"Main loop error: {str(e)}")
-                await asyncio.sleep(60)  # Wait before retry
+                logger.error("Summary error: %s", e)
     
     async def shutdown(self):
         """Shutdown bot gracefully"""
-        self.running = False
+        self.stop()
         
         logger.info("🛑 Shutting down bot...")
         
         # Send shutdown message
-        uptime = datetime.now() - self.stats['start_time']
+        uptime_seconds = int(time.monotonic() - self.start_monotonic)
+        hours, remainder = divmod(uptime_seconds, 3600)
+        minutes, seconds = divmod(remainder, 60)
         stats = await self.db.get_stats()
         
-        shutdown_msg = f"""
-🛑 <b>SHEIN BOT SHUTTING DOWN</b>
-
-📊 <b>Final Stats:</b>
-• Total Checks: {self.stats['checks']}
-• Products Found: {self.stats['products_found']}
-• Alerts Sent: {self.stats['alerts_sent']}
-• New Today: {stats['new_today']}
-• Restocks: {stats['restocks_today']}
-
-⏰ <b>Uptime:</b> {str(uptime).split('.')[0]}
-
-👋 <b>Goodbye!</b>
-"""
+        shutdown_msg = SHUTDOWN_TEMPLATE.format(
+            checks=self.stats['checks'],
+            products_found=self.stats['products_found'],
+            alerts_sent=self.stats['alerts_sent'],
+            new_today=stats['new_today'],
+            restocks_today=stats['restocks_today'],
+            hours=hours,
+            minutes=minutes,
+            seconds=seconds
+        )
         
         await self.telegram.send_message(shutdown_msg)
+        
         logger.info("✅ Bot shutdown complete")
 
 # Health check for Railway
@@ -221,7 +299,7 @@ async def start_health_server():
     site = web.TCPSite(runner, '0.0.0.0', port)
     
     await site.start()
-    logger.info(f"🌐 Health server running on port {port}")
+    logger.info("🌐 Health server running on port %d", port)
     
     return runner
 
@@ -240,30 +318,33 @@ async def main():
     # Create bot
     bot = SheinVerseBot()
     
-    # Setup signal handlers
-    def handle_signal(signum, frame):
-        logger.info(f"Received signal {signum}")
-        asyncio.create_task(shutdown_sequence(bot, health_runner))
+    # Setup signal handlers on the loop so stop() wakes pending sleeps at once
+    def handle_signal(signum):
+        logger.info("Received signal %s", signum)
+        bot.stop()  # main loop returns and the finally block shuts down
     
-    signal.signal(signal.SIGINT, handle_signal)
-    signal.signal(signal.SIGTERM, handle_signal)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, handle_signal, signum)
     
-    try:
-        # Initialize bot
-        if await bot.initialize():
-            # Run main loop
-            await bot.run()
-        else:
-            logger.error("Failed to initialize bot")
-    
-    except KeyboardInterrupt:
-        logger.info("Keyboard interrupt received")
-    except Exception as e:
-        logger.error(f"Fatal error: {str(e)}")
-    
-    finally:
-        # Shutdown
-        await shutdown_sequence(bot, health_runner)
+    # Pooled sessions are closed when the block exits, after the shutdown message
+    async with bot.telegram, bot.client:
+        try:
+            # Initialize bot
+            if await bot.initialize():
+                # Run main loop
+                await bot.run()
+            else:
+                logger.error("Failed to initialize bot")
+        
+        except KeyboardInterrupt:
+            logger.info("Keyboard interrupt received")
+        except Exception as e:
+            logger.error("Fatal error: %s", e)
+        
+        finally:
+            # Shutdown
+            await shutdown_sequence(bot, health_runner)
 
 async def shutdown_sequence(bot, health_runner):
     """Complete shutdown sequence"""
@@ -291,6 +372,13 @@ if __name__ == "__main__":
     
     print("\n🚀 Starting bot...")
     
+    # Faster libuv-based event loop where available
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    
     # Run main function
     try:
         asyncio.run(main())
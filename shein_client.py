@@ -7,21 +7,94 @@ import aiohttp
 import random
 import logging
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from bs4 import BeautifulSoup
+import soupsieve as sv
 import json
+import re
 import hashlib
+import importlib.util
 import urllib.parse
+from collections import Counter
+from cachetools import TTLCache
 
-from config import Config
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+    
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+# lxml builds the tree in C, much faster than the pure-Python html.parser
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+
+from config import Config, get_random_delay, get_random_proxy, get_random_referer, get_random_user_agent
 
 logger = logging.getLogger(__name__)
 
+# Markup that only appears on pages with a product grid
+PRODUCT_MARKERS = (
+    'S-product-item',
+    'c-product-list__item',
+    'product-card',
+    'j-expose__product-item',
+    'data-product-id'
+)
+
+# Markup of captcha / Cloudflare challenge pages
+BLOCK_MARKERS = ('cf-chl', 'captcha', 'challenge-platform')
+
+# CSS selectors, compiled once instead of on every scan
+PRODUCT_SELECTORS = tuple(
+    (selector, sv.compile(selector))
+    for selector in (
+        '.S-product-item',
+        '.c-product-list__item',
+        '.product-card',
+        '.j-expose__product-item',
+        'div[data-product-id]'
+    )
+)
+NAME_SELECTOR = sv.compile('.product-name, .goods-name, .name')
+PRICE_SELECTOR = sv.compile('.price, .current-price, .goods-price')
+IMAGE_SELECTOR = sv.compile('img')
+LINK_SELECTOR = sv.compile('a')
+SIZE_SELECTOR = sv.compile(
+    '.product-size-select option, '
+    '.sku-item, '
+    '.size-option, '
+    '[data-size]'
+)
+
+# Whole words only, so e.g. "brand" or "address" no longer match "bra"/"dress"
+WOMEN_KEYWORDS = frozenset({
+    'women', 'womens', 'woman', 'female', 'girl', 'girls', 'lady', 'ladies',
+    'dress', 'dresses', 'skirt', 'skirts', 'bra', 'bras'
+})
+WORD_RE = re.compile(r'[a-z]+')
+
+# Everything except digits and the decimal point
+PRICE_CLEAN_RE = re.compile(r'[^\d.]')
+
+# Case-insensitive "new" badge check, avoids lowercasing the card markup
+NEW_BADGE_RE = re.compile('new', re.IGNORECASE)
+
+# Minimum seconds between two requests, before the random delay
+MIN_REQUEST_INTERVAL = 2
+
 class SheinClient:
     def __init__(self):
         self.session = None
         self.request_count = 0
-        self.last_request_time = None
+        self.last_request_time = None  # Loop (monotonic) time of the latest reserved request
+        self._slot_lock = asyncio.Lock()
+        self._blocked_until = 0.0  # No requests before this loop time
+        self.strategy_wins = Counter()
+        # Parsed sizes by product URL, page HTML is never kept
+        self._details_cache = TTLCache(maxsize=Config.DETAILS_CACHE_SIZE, ttl=Config.DETAILS_CACHE_TTL)
         
     async def __aenter__(self):
         await self.create_session()
@@ -33,7 +106,7 @@ class SheinClient:
     async def create_session(self):
         """Create aiohttp session with anti-detection headers"""
         headers = {
-            'User-Agent': Config.get_random_user_agent(),
+            'User-Agent': get_random_user_agent(),
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.5',
             'Accept-Encoding': 'gzip, deflate, br',
@@ -47,100 +120,178 @@ class SheinClient:
             'Cache-Control': 'max-age=0',
         }
         
-        timeout = aiohttp.ClientTimeout(total=Config.REQUEST_TIMEOUT)
-        connector = aiohttp.TCPConnector(limit=10, ssl=False)
+        # Per-phase limits so a stuck connect or read fails fast
+        timeout = aiohttp.ClientTimeout(
+            total=Config.REQUEST_TIMEOUT,
+            connect=Config.CONNECT_TIMEOUT,
+            sock_connect=Config.CONNECT_TIMEOUT,
+            sock_read=Config.READ_TIMEOUT
+        )
+        connector = aiohttp.TCPConnector(
+            limit=10,
+            ssl=False,
+            ttl_dns_cache=Config.DNS_CACHE_TTL,
+            keepalive_timeout=Config.KEEPALIVE_TIMEOUT,
+            enable_cleanup_closed=True
+        )
         
         self.session = aiohttp.ClientSession(
             headers=headers,
+            cookies=Config.SHEIN_COOKIES,
             timeout=timeout,
             connector=connector
         )
         
         logger.info("Created new session")
     
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared session, creating it on first use"""
+        if self.session is None or self.session.closed:
+            await self.create_session()
+        return self.session
+    
     async def close_session(self):
         """Close session"""
         if self.session and not self.session.closed:
             await self.session.close()
             logger.info("Session closed")
     
-    async def _make_request(self, url: str, method: str = "GET", **kwargs) -> Optional[str]:
-        """Make request with anti-detection measures"""
-        
-        # Rate limiting
-        if self.last_request_time:
-            elapsed = (datetime.now() - self.last_request_time).total_seconds()
-            if elapsed < 2:  # Minimum 2 seconds between requests
-                await asyncio.sleep(2 - elapsed)
-        
-        # Random delay
-        await asyncio.sleep(Config.get_random_delay())
+    async def _make_request(self, url: str, method: str = "GET", as_json: bool = False,
+                            **kwargs) -> Optional[Any]:
+        """
+        Make request with anti-detection measures
+        With as_json, the raw body bytes are handed to the JSON parser and
+        the parsed object is returned instead of the text.
+        """
+        
+        # Rate limiting, also across concurrent detail fetches
+        await self._wait_for_slot()
+        
+        # Rotate headers per request, strategy-specific headers win
+        headers = {
+            'User-Agent': get_random_user_agent(),
+            'Referer': get_random_referer()
+        }
+        headers.update(kwargs.pop('headers', None) or {})
         
-        # Rotate headers
-        if self.session:
-            self.session.headers.update({
-                'User-Agent': Config.get_random_user_agent(),
-                'Referer': f'https://www.google.com/search?q={random.randint(1000, 9999)}'
-            })
+        session = await self._get_session()
         
         try:
-            proxy = Config.get_random_proxy()
+            proxy = get_random_proxy()
             
-            logger.debug(f"Requesting: {url[:80]}...")
+            logger.debug("Requesting: %.80s...", url)
             
-            async with self.session.request(
+            async with session.request(
                 method, 
                 url, 
+                headers=headers,
                 proxy=proxy,
                 **kwargs
             ) as response:
                 
                 self.request_count += 1
-                self.last_request_time = datetime.now()
                 
                 if response.status == 200:
-                    content = await response.text()
-                    logger.debug(f"Success: {url[:50]}")
+                    if as_json:
+                        # orjson and json.loads both accept bytes, no str decode needed
+                        content = _json_loads(await response.read())
+                    elif response.content_type == 'text/html':
+                        content = await self._read_capped(response, Config.MAX_PAGE_BYTES)
+                    else:
+                        content = await response.text()
+                    logger.debug("Success: %.50s", url)
                     return content
                 
                 elif response.status == 403:
-                    logger.warning(f"Blocked (403): {url}")
+                    logger.warning("Blocked (403): %s", url)
                     await self._handle_blocked()
                     return None
                 
                 elif response.status == 429:
-                    logger.warning(f"Rate limited (429): {url}")
-                    await asyncio.sleep(30)
+                    logger.warning("Rate limited (429): %s", url)
+                    self._pause_requests(30)
                     return None
                 
                 else:
-                    logger.warning(f"Status {response.status}: {url}")
+                    logger.warning("Status %d: %s", response.status, url)
                     return None
                     
         except aiohttp.ClientError as e:
-            logger.warning(f"Network error: {str(e)}")
+            logger.warning("Network error: %s", e)
             return None
         except asyncio.TimeoutError:
-            logger.warning(f"Timeout: {url}")
+            logger.warning("Timeout: %s", url)
+            return None
+        except ValueError as e:
+            logger.warning("Invalid JSON from %s: %s", url, e)
             return None
         except Exception as e:
-            logger.error(f"Request error: {str(e)}")
+            logger.error("Request error: %s", e)
             return None
     
+    async def _wait_for_slot(self):
+        """
+        Wait for this request's turn
+        Each request reserves its start time under a lock, at least
+        MIN_REQUEST_INTERVAL plus a random delay after the previous one and
+        never while blocked, so concurrent callers don't fire together.
+        """
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            async with self._slot_lock:
+                now = loop.time()
+                start = max(now, self._blocked_until)
+                if self.last_request_time is not None:
+                    start = max(start, self.last_request_time + MIN_REQUEST_INTERVAL)
+                start += get_random_delay()
+                self.last_request_time = start
+            
+            await asyncio.sleep(start - now)
+            
+            # A block that began while waiting pushes this request back
+            if loop.time() >= self._blocked_until:
+                return
+    
+    @staticmethod
+    async def _read_capped(response: aiohttp.ClientResponse, limit: int) -> str:
+        """
+        Read at most `limit` bytes of the body and decode them
+        Stopping early leaves body data unread, so aiohttp closes that
+        connection instead of returning it to the pool. Bodies that declare
+        a Content-Length within the limit are read whole to keep keep-alive.
+        """
+        if response.content_length is not None and response.content_length <= limit:
+            return await response.text()
+        
+        chunks = []
+        size = 0
+        
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= limit:
+                logger.debug("Body truncated at %d bytes", limit)
+                break
+        
+        raw = b''.join(chunks)[:limit]
+        return raw.decode(response.charset or 'utf-8', errors='replace')
+    
+    def _pause_requests(self, seconds: float):
+        """Hold back every request, including concurrent ones, for `seconds`"""
+        loop = asyncio.get_running_loop()
+        self._blocked_until = max(self._blocked_until, loop.time() + seconds)
+        logger.info("Pausing requests for %d seconds...", seconds)
+    
     async def _handle_blocked(self):
         """Handle when blocked by Shein"""
         logger.warning("Detected blocking. Taking evasive action...")
         
-        # Close current session
-        await self.close_session()
-        
-        # Wait random time
-        wait_time = random.randint(30, 120)
-        logger.info(f"Waiting {wait_time} seconds...")
-        await asyncio.sleep(wait_time)
+        # Wait a random time before trying again
+        self._pause_requests(random.randint(30, 120))
         
-        # Create new session
-        await self.create_session()
+        # Drop the session, the next request after the pause opens a fresh one
+        await self.close_session()
     
     async def get_shein_verse_men(self) -> List[Dict]:
         """Get Men's products from Shein Verse"""
@@ -151,25 +302,23 @@ class SheinClient:
             self._strategy_mobile_site
         ]
         
+        # Try whatever has worked most often first (stable on ties)
+        strategies.sort(key=lambda s: self.strategy_wins[s.__name__], reverse=True)
+        
         for strategy in strategies:
             try:
-                logger.info(f"Trying strategy: {strategy.__name__}")
+                logger.info("Trying strategy: %s", strategy.__name__)
                 products = await strategy()
                 
                 if products:
-                    logger.info(f"Strategy successful: {len(products)} products")
+                    logger.info("Strategy successful: %d products", len(products))
+                    self.strategy_wins[strategy.__name__] += 1
                     
                     # Get details for each product
-                    detailed_products = []
-                    for product in products:
-                        detailed = await self.get_product_details(product)
-                        if detailed:
-                            detailed_products.append(detailed)
-                    
-                    return detailed_products
+                    return await self._get_all_product_details(products)
                     
             except Exception as e:
-                logger.warning(f"Strategy failed: {str(e)}")
+                logger.warning("Strategy failed: %s", e)
                 await asyncio.sleep(5)
                 continue
         
@@ -193,52 +342,66 @@ class SheinClient:
         }
         
         headers = {
-            'User-Agent': Config.get_random_user_agent(),
+            'User-Agent': get_random_user_agent(),
             'Accept': 'application/json',
             'Content-Type': 'application/json',
             'Origin': Config.SHEIN_BASE_URL,
             'Referer': f"{Config.SHEIN_BASE_URL}/shein-verse-men-c-{Config.MEN_CATEGORY_ID}.html"
         }
         
-        # Update session headers
-        if self.session:
-            self.session.headers.update(headers)
-        
-        content = await self._make_request(
+        data = await self._make_request(
             api_url,
             method="POST",
-            json=payload
+            as_json=True,
+            headers=headers,
+            data=_json_dumps(payload)
         )
         
-        if not content:
+        if not data:
             return []
         
         try:
-            data = json.loads(content)
             goods = data.get('goods', [])
             
             products = []
+            seen_ids = set()
+            timestamp = datetime.now().isoformat()
             for item in goods:
+                # Skip items listed more than once
+                goods_id = item.get('goods_id')
+                if goods_id in seen_ids:
+                    continue
+                seen_ids.add(goods_id)
+                
                 if self._is_men_product(item):
-                    product = {
-                        'id': item.get('goods_id'),
-                        'name': item.get('goods_name', 'Unknown'),
-                        'price': item.get('salePrice', {}).get('amount', '0'),
-                        'original_price': item.get('retailPrice', {}).get('amount', '0'),
-                        'url': f"{Config.SHEIN_BASE_URL}{item.get('goods_url', '')}",
-                        'image': f"https:{item.get('goods_img', '')}" if item.get('goods_img') else "",
-                        'is_new': item.get('is_new', False),
-                        'category': 'Men',
-                        'timestamp': datetime.now().isoformat()
-                    }
-                    products.append(product)
+                    products.append(self._parse_api_item(item, goods_id, timestamp))
             
             return products
             
         except Exception as e:
-            logger.error(f"API parse error: {str(e)}")
+            logger.error("API parse error: %s", e)
             return []
     
+    @staticmethod
+    def _parse_api_item(item: Dict, goods_id: str, timestamp: str) -> Dict:
+        """Build a product dict from one API goods entry"""
+        get = item.get
+        sale_price = get('salePrice') or {}
+        retail_price = get('retailPrice') or {}
+        image = get('goods_img')
+        
+        return {
+            'id': goods_id,
+            'name': get('goods_name', 'Unknown'),
+            'price': sale_price.get('amount', '0'),
+            'original_price': retail_price.get('amount', '0'),
+            'url': f"{Config.SHEIN_BASE_URL}{get('goods_url', '')}",
+            'image': f"https:{image}" if image else "",
+            'is_new': get('is_new', False),
+            'category': 'Men',
+            'timestamp': timestamp
+        }
+    
     async def _strategy_html_scrape(self) -> List[Dict]:
         """HTML scraping strategy"""
         url = f"{Config.SHEIN_BASE_URL}/shein-verse-men-c-{Config.MEN_CATEGORY_ID}.html"
@@ -250,7 +413,8 @@ class SheinClient:
         if not content:
             return []
         
-        return self._parse_html_products(content)
+        # Parse in a worker thread to keep the event loop responsive
+        return await asyncio.to_thread(self._parse_html_products, content)
     
     async def _strategy_mobile_site(self) -> List[Dict]:
         """Use mobile site"""
@@ -260,48 +424,52 @@ class SheinClient:
             'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1'
         }
         
-        if self.session:
-            self.session.headers.update(headers)
-        
-        content = await self._make_request(mobile_url)
+        content = await self._make_request(mobile_url, headers=headers)
         if not content:
             return []
         
-        return self._parse_html_products(content)
+        return await asyncio.to_thread(self._parse_html_products, content)
     
     def _parse_html_products(self, html: str) -> List[Dict]:
         """Parse products from HTML"""
         products = []
-        soup = BeautifulSoup(html, 'html.parser')
         
-        # Try multiple selectors
-        selectors = [
-            '.S-product-item',
-            '.c-product-list__item',
-            '.product-card',
-            '.j-expose__product-item',
-            'div[data-product-id]'
-        ]
+        # Cheap substring check before paying for a full parse
+        if not any(marker in html for marker in PRODUCT_MARKERS):
+            if any(marker in html for marker in BLOCK_MARKERS):
+                logger.warning("Blocked: received captcha/challenge page")
+            else:
+                logger.debug("No product markup in page, skipping parse")
+            return products
+        
+        soup = BeautifulSoup(html, HTML_PARSER)
         
-        for selector in selectors:
-            items = soup.select(selector)
+        # Try multiple selectors
+        for selector, compiled in PRODUCT_SELECTORS:
+            items = compiled.select(soup)
             if items:
-                logger.info(f"Found {len(items)} items with selector: {selector}")
+                logger.info("Found %d items with selector: %s", len(items), selector)
+                timestamp = datetime.now().isoformat()
+                seen_urls = set()
                 
                 for item in items[:30]:  # Limit to avoid rate limiting
                     try:
-                        product = self._extract_product_info(item)
-                        if product and self._is_men_product(product):
+                        product = self._extract_product_info(item, timestamp)
+                        if not product or product['url'] in seen_urls:
+                            continue
+                        seen_urls.add(product['url'])
+                        
+                        if self._is_men_product(product):
                             products.append(product)
                     except Exception as e:
-                        logger.debug(f"Parse error: {str(e)}")
+                        logger.debug("Parse error: %s", e)
                         continue
                 
                 break
         
         return products
     
-    def _extract_product_info(self, element) -> Optional[Dict]:
+    def _extract_product_info(self, element, timestamp: str) -> Optional[Dict]:
         """Extract product info from HTML element"""
         try:
             # Get product ID
@@ -310,25 +478,24 @@ class SheinClient:
                         str(random.randint(1000000, 9999999))
             
             # Get name
-            name_elem = element.select_one('.product-name, .goods-name, .name')
+            name_elem = NAME_SELECTOR.select_one(element)
             name = name_elem.get_text(strip=True) if name_elem else "Unknown Product"
             
             # Get price
-            price_elem = element.select_one('.price, .current-price, .goods-price')
+            price_elem = PRICE_SELECTOR.select_one(element)
             price = price_elem.get_text(strip=True) if price_elem else "₹0"
             
             # Clean price
-            import re
-            price = re.sub(r'[^\d.]', '', price)
+            price = PRICE_CLEAN_RE.sub('', price)
             
             # Get image
-            img_elem = element.select_one('img')
-            image_url = img_elem.get('src') or img_elem.get('data-src') or ''
+            img_elem = IMAGE_SELECTOR.select_one(element)
+            image_url = (img_elem.get('src') or img_elem.get('data-src') or '') if img_elem else ''
             if image_url and not image_url.startswith('http'):
                 image_url = f"https:{image_url}"
             
             # Get URL
-            link_elem = element.select_one('a')
+            link_elem = LINK_SELECTOR.select_one(element)
             href = link_elem.get('href') if link_elem else ''
             if href and not href.startswith('http'):
                 product_url = f"{Config.SHEIN_BASE_URL}{href}"
@@ -342,50 +509,55 @@ class SheinClient:
                 'original_price': '',
                 'url': product_url,
                 'image': image_url,
-                'is_new': 'new' in str(element).lower(),
+                'is_new': NEW_BADGE_RE.search(str(element)) is not None,
                 'category': 'Men',
-                'timestamp': datetime.now().isoformat()
+                'timestamp': timestamp
             }
             
         except Exception as e:
-            logger.debug(f"Extract error: {str(e)}")
+            logger.debug("Extract error: %s", e)
             return None
     
     def _is_men_product(self, product: Dict) -> bool:
         """Check if product is for Men"""
-        name = product.get('name', '').lower()
+        name = (product.get('name') or product.get('goods_name', '')).lower()
         
         # Women keywords to exclude
-        women_keywords = ['women', 'woman', 'female', 'girl', 'lady', 'ladies', 'dress', 'skirt', 'bra']
-        for keyword in women_keywords:
-            if keyword in name:
-                return False
-        
-        # Men keywords to include
-        men_keywords = ['men', 'man', 'male', 'boy', 'guy', 'unisex']
-        for keyword in men_keywords:
-            if keyword in name:
-                return True
-        
-        # Default to True for Shein Verse (mostly men's)
+        if not WOMEN_KEYWORDS.isdisjoint(WORD_RE.findall(name)):
+            return False
+        
+        # Men's keywords or not, default to True for Shein Verse (mostly men's)
         return True
     
+    async def _get_all_product_details(self, products: List[Dict]) -> List[Dict]:
+        """
+        Fetch product details for all products
+        Requests still go out one slot at a time (see _wait_for_slot), the
+        gather only lets page parsing overlap with the next request's wait.
+        """
+        detailed = await asyncio.gather(*(self.get_product_details(product) for product in products))
+        return [product for product in detailed if product]
+    
     async def get_product_details(self, product: Dict) -> Dict:
         """Get detailed product info including sizes"""
-        if not product.get('url'):
+        url = product.get('url')
+        if not url:
             return product
         
-        # Wait before detail request
-        await asyncio.sleep(random.uniform(3, 7))
-        
-        content = await self._make_request(product['url'])
-        if not content:
-            return product
-        
-        # Parse sizes
-        sizes = self._parse_sizes(content)
+        sizes = self._details_cache.get(url)
+        if sizes is None:
+            content = await self._make_request(url)
+            if not content:
+                return product
+            
+            # Parse sizes
+            sizes = await asyncio.to_thread(self._parse_sizes, content)
+            
+            # Sold-out pages are refetched every scan so restocks show up at once
+            if any(sizes.values()):
+                self._details_cache[url] = sizes
         
-        product['sizes'] = sizes
+        product['sizes'] = dict(sizes)
         product['available_sizes'] = [size for size, qty in sizes.items() if qty > 0]
         product['total_stock'] = sum(sizes.values())
         product['size_details'] = "\n".join([
@@ -396,18 +568,17 @@ class SheinClient:
         
         return product
     
+    def invalidate_details(self, url: str):
+        """Drop cached sizes for a product page"""
+        self._details_cache.pop(url, None)
+    
     def _parse_sizes(self, html: str) -> Dict[str, int]:
         """Parse sizes from product page"""
         sizes = {}
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = BeautifulSoup(html, HTML_PARSER)
         
         # Look for size elements
-        size_elements = soup.select(
-            '.product-size-select option, '
-            '.sku-item, '
-            '.size-option, '
-            '[data-size]'
-        )
+        size_elements = SIZE_SELECTOR.select(soup)
         
         for elem in size_elements:
             size_text = elem.get_text(strip=True)
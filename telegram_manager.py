@@ -4,20 +4,182 @@ Telegram alert manager
 
 import asyncio
 import aiohttp
+import functools
+import html
+import json
 import logging
 from datetime import datetime
 import os
-from typing import Dict, List
+import re
+import socket
+import time
+from typing import Dict, List, Tuple
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+    
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
 
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Telegram Bot API limits
+MEDIA_GROUP_LIMIT = 10
+CAPTION_LIMIT = 1024
+JSON_HEADERS = {'Content-Type': 'application/json'}
+API_BASE_URL = "https://api.telegram.org"
+SEND_INTERVAL = 1.0  # All alerts go to one chat, limited to about 1 message per second
+SEND_ATTEMPTS = 2  # A 429 or 5xx is retried once
+
+# (label, emoji) keyed by is_new
+ALERT_TYPES = {
+    True: ("🆕 NEW PRODUCT", "🔥"),
+    False: ("🔄 RESTOCK", "⚡")
+}
+
+PRODUCT_ALERT_TEMPLATE = """
+{emoji} <b>{alert_type}</b> {emoji}
+
+🏷️ <b>{name}</b>
+
+💰 <b>Price:</b> ₹{price}
+📏 <b>Available Sizes:</b>
+{size_info}
+
+📦 <b>Total Stock:</b> {total_stock}
+
+🛒 <b>BUY NOW:</b> <a href="{app_link}">Open in SHEIN App</a>
+🔗 <b>Web Link:</b> <a href="{url}">Click Here</a>
+
+⏰ <i>{time}</i>
+
+⚡ <b>Be quick! Limited stock available!</b>
+"""
+
+# Only depends on config, so it is built once at import
+STARTUP_MESSAGE = f"""
+🤖 <b>SHEIN VERSE BOT ACTIVATED</b> 🤖
+
+✅ <b>Status:</b> Running on Railway
+✅ <b>Tracking:</b> Shein Verse - Men's Section
+✅ <b>Anti-Detection:</b> Active
+✅ <b>Alerts:</b> Enabled with images & links
+
+⚡ <b>You will receive:</b>
+• New product alerts
+• Restock notifications  
+• Size availability
+• Direct app links
+• Product images
+
+🛡️ <b>Protection:</b> Advanced anti-blocking
+🕒 <b>Check Interval:</b> {Config.CHECK_INTERVAL_MINUTES} MIN
+
+🎯 <i>Ready to monitor stock...</i>
+"""
+
+ERROR_ALERT_TEMPLATE = """
+⚠️ <b>BOT ERROR DETECTED</b>
+
+❌ <b>Error:</b> {error}{repeats}
+
+🔧 <b>Action:</b> Bot will attempt recovery
+⏰ <b>Time:</b> {time}
+"""
+
+# Several text-only alerts fused into one message
+DIGEST_TEMPLATE = """
+🚨 <b>{count} PRODUCT ALERTS</b> 🚨
+{items}
+
+⏰ <i>{time}</i>
+"""
+
+DIGEST_ITEM_TEMPLATE = """
+{emoji} <a href="{url}">{name}</a>
+💰 ₹{price} · 📦 {total_stock} in stock"""
+
+# Product ID in web URLs like .../p-12345.html
+APP_LINK_RE = re.compile(r'p-(\d+)\.html')
+
+SUMMARY_TEMPLATE = """
+📊 <b>SHEIN VERSE - STATUS SUMMARY</b>
+
+📅 {date}
+
+📦 <b>Total Products:</b> {total_products}
+🆕 <b>New Today:</b> {new_today}
+🔄 <b>Restocks Today:</b> {restocks_today}
+🚨 <b>Alerts Sent:</b> {alerts_sent}
+
+⏰ <b>Last Check:</b> {last_check}
+✅ <b>Bot Status:</b> Running
+"""
+
+# (epoch second, formatted) of the last _hms_now call
+_hms_cache = [None, ""]
+
+def _hms_now() -> str:
+    """Local time as HH:MM:SS, formatted at most once per second"""
+    now = int(time.time())
+    if now != _hms_cache[0]:
+        t = time.localtime(now)
+        _hms_cache[:] = [now, f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}"]
+    return _hms_cache[1]
+
 class TelegramManager:
     def __init__(self):
         self.token = Config.TELEGRAM_BOT_TOKEN
         self.chat_id = Config.TELEGRAM_CHAT_ID
-        self.base_url = f"https://api.telegram.org/bot{self.token}"
+        # Paths relative to the session's base_url, built once
+        self.api_paths = {
+            method: f"/bot{self.token}/{method}"
+            for method in ('getMe', 'sendMessage', 'sendPhoto', 'sendMediaGroup')
+        }
+        self._session = None
+        self._send_lock = asyncio.Lock()
+        self._next_send = 0.0  # Loop time the next Bot API call may start
+        # error[:100] -> (monotonic time last sent, repeats suppressed since)
+        self._error_history: Dict[str, Tuple[float, int]] = {}
+    
+    async def __aenter__(self):
+        await self._get_session()
+        return self
+    
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            # Keep the connection to api.telegram.org warm between alerts
+            # api.telegram.org is reached over IPv4, skip the IPv6 attempt
+            connector = aiohttp.TCPConnector(
+                limit=20,
+                use_dns_cache=True,
+                ttl_dns_cache=600,
+                family=socket.AF_INET,
+                keepalive_timeout=75
+            )
+            # One timeout for every call instead of a timer per request
+            timeout = aiohttp.ClientTimeout(total=10, connect=5)
+            self._session = aiohttp.ClientSession(
+                base_url=API_BASE_URL,
+                connector=connector,
+                timeout=timeout
+            )
+        return self._session
+    
+    async def close(self):
+        """Close the shared session"""
+        if self._session and not self._session.closed:
+            await self._session.close()
         
     async def test_connection(self) -> bool:
         """Test Telegram connection"""
@@ -25,19 +187,19 @@ class TelegramManager:
             logger.error("Telegram credentials missing")
             return False
         
-        url = f"{self.base_url}/getMe"
+        url = self.api_paths['getMe']
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=10) as response:
-                    if response.status == 200:
-                        logger.info("✅ Telegram connection successful")
-                        return True
-                    else:
-                        logger.error(f"Telegram error: {response.status}")
-                        return False
+            session = await self._get_session()
+            async with session.get(url) as response:
+                if response.status == 200:
+                    logger.info("✅ Telegram connection successful")
+                    return True
+                else:
+                    logger.error("Telegram error: %d", response.status)
+                    return False
         except Exception as e:
-            logger.error(f"Telegram connection failed: {str(e)}")
+            logger.error("Telegram connection failed: %s", e)
             return False
     
     async def send_message(self, text: str, parse_mode: str = "HTML") -> bool:
@@ -46,7 +208,7 @@ class TelegramManager:
             logger.error("Cannot send: Telegram not configured")
             return False
         
-        url = f"{self.base_url}/sendMessage"
+        url = self.api_paths['sendMessage']
         
         payload = {
             'chat_id': self.chat_id,
@@ -56,20 +218,159 @@ class TelegramManager:
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload, timeout=10) as response:
-                    if response.status == 200:
-                        return True
-                    else:
-                        error = await response.text()
-                        logger.error(f"Telegram send error: {error}")
-                        return False
+            status, error = await self._post(url, payload)
         except Exception as e:
-            logger.error(f"Send message error: {str(e)}")
+            logger.error("Send message error: %s", e)
             return False
+        
+        if status != 200:
+            logger.error("Telegram send error: %s", error)
+            return False
+        return True
+    
+    async def _post(self, url: str, payload: Dict) -> Tuple[int, str]:
+        """
+        POST a Bot API call, returns (status, error body)
+        A 429 waits out Telegram's retry_after and a 5xx backs off before
+        the call is retried.
+        """
+        session = await self._get_session()
+        body = _json_dumps(payload)
+        
+        # An album counts as one message per photo
+        messages = len(payload.get('media', ())) or 1
+        
+        for attempt in range(SEND_ATTEMPTS):
+            await self._wait_send_slot(messages)
+            
+            async with session.post(url, data=body, headers=JSON_HEADERS) as response:
+                status = response.status
+                if status == 200:
+                    return status, ""
+                
+                last_attempt = attempt == SEND_ATTEMPTS - 1
+                if status == 429 and not last_attempt:
+                    # Proxies may answer 429 with a non-JSON page
+                    try:
+                        retry_after = _json_loads(await response.read())['parameters']['retry_after']
+                    except (ValueError, KeyError, TypeError):
+                        retry_after = 1
+                    delay = retry_after + 0.1
+                elif status >= 500 and not last_attempt:
+                    delay = 0.5 * 2 ** attempt
+                else:
+                    # Only read the error body if it will be logged
+                    error = await response.text() if logger.isEnabledFor(logging.ERROR) else ""
+                    return status, error
+            
+            logger.warning("Telegram returned %d, retrying in %.1fs", status, delay)
+            await asyncio.sleep(delay)
+    
+    async def _wait_send_slot(self, messages: int):
+        """Space Bot API calls so the chat sees about one message per second"""
+        loop = asyncio.get_running_loop()
+        async with self._send_lock:
+            now = loop.time()
+            start = max(now, self._next_send)
+            self._next_send = start + SEND_INTERVAL * messages
+        await asyncio.sleep(start - now)
     
     async def send_product_alert(self, product: Dict, is_new: bool = True):
         """Send product alert with all details"""
+        message = self._format_product_alert(product, is_new)
+        
+        if not product.get('image'):
+            return await self.send_message(message)
+        
+        # Whole alert fits as the photo caption, one request
+        if len(message) <= CAPTION_LIMIT:
+            return await self.send_photo(product['image'], message, limit=CAPTION_LIMIT, text_fallback=True)
+        
+        # Too long for a caption, send message then image
+        success = await self.send_message(message)
+        if success:
+            # Escaping can grow the 50-char name, don't let the caption cut split an entity
+            await self.send_photo(product['image'], html.escape(product['name'][:50]), limit=CAPTION_LIMIT)
+        
+        return success
+    
+    async def send_product_alerts(self, alerts: List[Tuple[Dict, bool]]) -> int:
+        """
+        Send a batch of product alerts
+        Products with images are grouped into albums of up to 10 photos,
+        the rest are listed together in digest messages of up to 10.
+        Returns: number of alerts delivered
+        """
+        grouped = []
+        single = []
+        
+        for product, is_new in alerts:
+            caption = self._format_product_alert(product, is_new)
+            if product.get('image') and len(caption) <= CAPTION_LIMIT:
+                grouped.append((product, caption))
+            else:
+                single.append((product, is_new))
+        
+        # Queued together, _post paces the actual requests to the chat
+        sends = [
+            self._send_album(grouped[i:i + MEDIA_GROUP_LIMIT])
+            for i in range(0, len(grouped), MEDIA_GROUP_LIMIT)
+        ]
+        sends.extend(
+            self._send_digest(single[i:i + MEDIA_GROUP_LIMIT])
+            for i in range(0, len(single), MEDIA_GROUP_LIMIT)
+        )
+        
+        results = await asyncio.gather(*sends)
+        return sum(results)
+    
+    async def _send_album(self, chunk: List[Tuple[Dict, str]]) -> int:
+        """Send up to 10 captioned photos, returns alerts delivered"""
+        if len(chunk) == 1:
+            # Albums need at least 2 items
+            product, caption = chunk[0]
+            ok = await self.send_photo(product['image'], caption, limit=CAPTION_LIMIT, text_fallback=True)
+            return 1 if ok else 0
+        
+        media = [
+            {
+                'type': 'photo',
+                'media': product['image'],
+                'caption': caption,
+                'parse_mode': 'HTML'
+            }
+            for product, caption in chunk
+        ]
+        return len(chunk) if await self.send_media_group(media) else 0
+    
+    async def _send_single(self, product: Dict, is_new: bool) -> int:
+        """Send one alert as message + photo, returns alerts delivered"""
+        return 1 if await self.send_product_alert(product, is_new) else 0
+    
+    async def _send_digest(self, chunk: List[Tuple[Dict, bool]]) -> int:
+        """Send several alerts as one linked list message, returns alerts delivered"""
+        if len(chunk) == 1:
+            return await self._send_single(*chunk[0])
+        
+        items = "\n".join(
+            DIGEST_ITEM_TEMPLATE.format(
+                emoji=ALERT_TYPES[is_new][1],
+                url=html.escape(product['url']),
+                name=html.escape(product['name']),
+                price=html.escape(str(product['price'])),
+                total_stock=product.get('total_stock', 'N/A')
+            )
+            for product, is_new in chunk
+        )
+        message = DIGEST_TEMPLATE.format(
+            count=len(chunk),
+            items=items,
+            time=_hms_now()
+        )
+        return len(chunk) if await self.send_message(message) else 0
+    
+    def _format_product_alert(self, product: Dict, is_new: bool) -> str:
+        """Build alert message for a product"""
         
         # Create app deep link
         app_link = self._create_app_link(product['url'])
@@ -82,68 +383,85 @@ class TelegramManager:
         if not size_info:
             size_info = "Check product page for sizes"
         
-        # Determine alert type
-        if is_new:
-            alert_type = "🆕 NEW PRODUCT"
-            emoji = "🔥"
-        else:
-            alert_type = "🔄 RESTOCK"
-            emoji = "⚡"
+        alert_type, emoji = ALERT_TYPES[is_new]
         
-        # Format message
-        message = f"""
-{emoji} <b>{alert_type}</b> {emoji}
-
-🏷️ <b>{product['name']}</b>
-
-💰 <b>Price:</b> ₹{product['price']}
-📏 <b>Available Sizes:</b>
-{size_info}
-
-📦 <b>Total Stock:</b> {product.get('total_stock', 'N/A')}
-
-🛒 <b>BUY NOW:</b> <a href="{app_link}">Open in SHEIN App</a>
-🔗 <b>Web Link:</b> <a href="{product['url']}">Click Here</a>
-
-⏰ <i>{datetime.now().strftime('%H:%M:%S')}</i>
-
-⚡ <b>Be quick! Limited stock available!</b>
-"""
+        return PRODUCT_ALERT_TEMPLATE.format(
+            emoji=emoji,
+            alert_type=alert_type,
+            name=html.escape(product['name']),
+            price=html.escape(str(product['price'])),
+            size_info=html.escape(size_info),
+            total_stock=product.get('total_stock', 'N/A'),
+            app_link=html.escape(app_link),
+            url=html.escape(product['url']),
+            time=_hms_now()
+        )
+    
+    async def send_photo(self, photo_url: str, caption: str = "", limit: int = 100,
+                         text_fallback: bool = False) -> bool:
+        """
+        Send photo to Telegram
+        With text_fallback, the caption is sent as a plain message if
+        Telegram rejects the photo URL.
+        """
+        url = self.api_paths['sendPhoto']
         
-        # Send message
-        success = await self.send_message(message)
+        payload = {
+            'chat_id': self.chat_id,
+            'photo': photo_url,
+            'caption': caption[:limit],
+            'parse_mode': 'HTML'
+        }
         
-        # Send image if available
-        if success and product.get('image'):
-            await self.send_photo(product['image'], product['name'][:50])
+        try:
+            status, _ = await self._post(url, payload)
+        except Exception as e:
+            logger.error("Send photo error: %s", e)
+            return False
         
-        return success
+        if status == 400 and text_fallback and caption:
+            logger.warning("Telegram rejected photo, sending text only")
+            return await self.send_message(caption)
+        
+        return status == 200
     
-    async def send_photo(self, photo_url: str, caption: str = "") -> bool:
-        """Send photo to Telegram"""
-        url = f"{self.base_url}/sendPhoto"
+    async def send_media_group(self, media: List[Dict]) -> bool:
+        """
+        Send an album of 2-10 photos in a single request
+        If Telegram rejects the album, captions are sent as plain messages.
+        """
+        url = self.api_paths['sendMediaGroup']
         
         payload = {
             'chat_id': self.chat_id,
-            'photo': photo_url,
-            'caption': caption[:100],
-            'parse_mode': 'HTML'
+            'media': media
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload, timeout=10) as response:
-                    return response.status == 200
+            status, error = await self._post(url, payload)
+            if status == 200:
+                return True
+            logger.error("Telegram media group error: %s", error)
         except Exception as e:
-            logger.error(f"Send photo error: {str(e)}")
+            logger.error("Send media group error: %s", e)
+            return False
+        
+        if status != 400:
             return False
+        
+        # Usually an image URL Telegram could not fetch
+        logger.warning("Telegram rejected album, sending text only")
+        results = await asyncio.gather(*(
+            self.send_message(item['caption']) for item in media
+        ))
+        return all(results)
     
-    def _create_app_link(self, web_url: str) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=2048)
+    def _create_app_link(web_url: str) -> str:
         """Create deep link for SHEIN app"""
-        import re
-        
         # Extract product ID
-        match = re.search(r'p-(\d+)\.html', web_url)
+        match = APP_LINK_RE.search(web_url)
         if match:
             product_id = match.group(1)
             return f"shein://product?id={product_id}"
@@ -153,56 +471,51 @@ class TelegramManager:
     
     async def send_startup_message(self):
         """Send bot startup message"""
-        message = f"""
-🤖 <b>SHEIN VERSE BOT ACTIVATED</b> 🤖
-
-✅ <b>Status:</b> Running on Railway
-✅ <b>Tracking:</b> Shein Verse - Men's Section
-✅ <b>Anti-Detection:</b> Active
-✅ <b>Alerts:</b> Enabled with images & links
-
-⚡ <b>You will receive:</b>
-• New product alerts
-• Restock notifications  
-• Size availability
-• Direct app links
-• Product images
-
-🛡️ <b>Protection:</b> Advanced anti-blocking
-🕒 <b>Check Interval:</b> {Config.CHECK_INTERVAL_MINUTES} MIN
-
-🎯 <i>Ready to monitor stock...</i>
-"""
-        
-        await self.send_message(message)
+        await self.send_message(STARTUP_MESSAGE)
     
     async def send_summary(self, stats: Dict):
         """Send periodic summary"""
-        message = f"""
-📊 <b>SHEIN VERSE - STATUS SUMMARY</b>
-
-📅 {datetime.now().strftime('%d %b %Y %H:%M')}
-
-📦 <b>Total Products:</b> {stats.get('total_products', 0)}
-🆕 <b>New Today:</b> {stats.get('new_today', 0)}
-🔄 <b>Restocks Today:</b> {stats.get('restocks_today', 0)}
-🚨 <b>Alerts Sent:</b> {stats.get('alerts_sent', 0)}
-
-⏰ <b>Last Check:</b> {stats.get('last_check', 'N/A')}
-✅ <b>Bot Status:</b> Running
-"""
+        message = SUMMARY_TEMPLATE.format(
+            date=datetime.now().strftime('%d %b %Y %H:%M'),
+            total_products=stats.get('total_products', 0),
+            new_today=stats.get('new_today', 0),
+            restocks_today=stats.get('restocks_today', 0),
+            alerts_sent=stats.get('alerts_sent', 0),
+            last_check=stats.get('last_check', 'N/A')
+        )
         
         await self.send_message(message)
     
     async def send_error_alert(self, error: str):
-        """Send error alert"""
-        message = f"""
-⚠️ <b>BOT ERROR DETECTED</b>
-
-❌ <b>Error:</b> {error[:100]}
-
-🔧 <b>Action:</b> Bot will attempt recovery
-⏰ <b>Time:</b> {datetime.now().strftime('%H:%M:%S')}
-"""
+        """
+        Send error alert
+        Repeats of the same error within Config.ERROR_ALERT_WINDOW are counted
+        instead of sent, and reported as "(xN)" on the next alert.
+        """
+        key = error[:100]
+        now = time.monotonic()
+        
+        last_sent, suppressed = self._error_history.get(key, (None, 0))
+        if last_sent is not None and now - last_sent < Config.ERROR_ALERT_WINDOW:
+            self._error_history[key] = (last_sent, suppressed + 1)
+            logger.debug("Suppressed repeated error alert: %s", key)
+            return
+        
+        # Forget errors whose window has passed so the history stays small
+        expired = [
+            k for k, (sent, _) in self._error_history.items()
+            if now - sent >= Config.ERROR_ALERT_WINDOW
+        ]
+        for k in expired:
+            _, repeats = self._error_history.pop(k)
+            if repeats and k != key:  # This key's count goes out with the alert below
+                logger.info("Error repeated %d more times without alert: %s", repeats, k)
+        self._error_history[key] = (now, 0)
+        
+        message = ERROR_ALERT_TEMPLATE.format(
+            error=html.escape(key),
+            repeats=f" (x{suppressed + 1})" if suppressed else "",
+            time=_hms_now()
+        )
         
         await self.send_message(message)